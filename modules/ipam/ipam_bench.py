@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress / latency benchmark for ipam_provider.py.
+
+Launches N concurrent ipam_provider.py processes (the way Terraform does with
+-parallelism) with a mix of vpc / subnet / reset requests against a throwaway
+state directory, then reports throughput and p50/p99 latency split into
+lock-wait and work time, and verifies the final state:
+
+  * every request exited 0 with a JSON result (nothing lost or crashed)
+  * no two allocations overlap (AllocationIndex validation)
+  * "sticky" VPCs (never reset) still hold every CIDR handed out for them
+
+Usage:
+  python3 modules/ipam/ipam_bench.py --procs 32 --requests 500
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROVIDER   = os.path.join(SCRIPT_DIR, "ipam_provider.py")
+
+sys.path.insert(0, SCRIPT_DIR)
+from ipam_provider import AllocationIndex, load_json  # noqa: E402
+
+# ─── Workload ─────────────────────────────────────────────────────────────────
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("vpc", "subnet", "reset"):
+            raise SystemExit(f"unknown request type in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def build_workload(args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+
+    sticky = [f"sticky-{i}" for i in range(args.vpcs)]
+    churn  = [f"churn-{i}" for i in range(args.vpcs)]
+
+    reqs = []
+    for _ in range(args.requests):
+        kind = rng.choices(kinds, weights)[0]
+        # resets only ever target churn VPCs so sticky ones can be verified
+        name = rng.choice(churn) if kind == "reset" else rng.choice(sticky + churn)
+        q = {"resource_type": kind, "env": "bench", "vpc_name": name}
+        if kind == "subnet":
+            q["public_count"]  = str(rng.randint(1, 3))
+            q["private_count"] = str(rng.randint(1, 3))
+        reqs.append(q)
+    return reqs
+
+# ─── Runner ───────────────────────────────────────────────────────────────────
+def run_one(q, env):
+    t0 = time.perf_counter()
+    p = subprocess.run(
+        [sys.executable, PROVIDER],
+        input=json.dumps(q), capture_output=True, text=True, env=env,
+    )
+    elapsed = time.perf_counter() - t0
+
+    timing = {}
+    for line in p.stderr.splitlines():
+        try:
+            timing = json.loads(line).get("ipam_timing", timing)
+        except (json.JSONDecodeError, AttributeError):
+            continue
+    try:
+        result = json.loads(p.stdout) if p.returncode == 0 else None
+    except json.JSONDecodeError:
+        result = None
+
+    return {
+        "query":     q,
+        "ok":        result is not None,
+        "result":    result,
+        "stderr":    p.stderr.strip(),
+        "latency":   elapsed,
+        "lock_wait": timing.get("lock_wait_s"),
+        "work":      timing.get("work_s"),
+    }
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(pct / 100.0 * len(s)) - 1))
+    return s[k]
+
+# ─── Verification ─────────────────────────────────────────────────────────────
+def verify(results, state):
+    problems = []
+
+    for r in results:
+        if not r["ok"]:
+            problems.append(f"request failed: {json.dumps(r['query'])}: {r['stderr'][-300:]}")
+
+    try:
+        AllocationIndex(state)
+    except RuntimeError as e:
+        problems.append(f"final state invalid: {e}")
+
+    vpcs = state.get("vpcs", {})
+    subs = state.get("subnets", {})
+    for r in results:
+        q, res = r["query"], r["result"]
+        if not res or not q["vpc_name"].startswith("sticky-"):
+            continue
+        key = f"{q['env']}|{q['vpc_name']}"
+        if q["resource_type"] == "vpc":
+            have = vpcs.get(key, {}).get("cidr")
+            if have != res["cidr"]:
+                problems.append(f"lost VPC allocation for {key}: returned {res['cidr']}, state has {have}")
+        elif q["resource_type"] == "subnet":
+            alloc = subs.get(key, {})
+            have = set(alloc.get("public", [])) | set(alloc.get("private", []))
+            for c in filter(None, (res["public_subnets"] + "," + res["private_subnets"]).split(",")):
+                if c not in have:
+                    problems.append(f"lost subnet allocation for {key}: {c}")
+    return problems
+
+# ─── Main ─────────────────────────────────────────────────────────────────────
+def main():
+    ap = argparse.ArgumentParser(description="Stress-test ipam_provider.py with concurrent processes")
+    ap.add_argument("--procs", type=int, default=16, help="Concurrent provider processes")
+    ap.add_argument("--requests", type=int, default=200, help="Total requests to issue")
+    ap.add_argument("--vpcs", type=int, default=8, help="Distinct VPC names per group (sticky / churn)")
+    ap.add_argument("--mix", default="vpc=4,subnet=5,reset=1", help="Request weights, e.g. vpc=4,subnet=5,reset=1")
+    ap.add_argument("--seed", type=int, default=0, help="Workload RNG seed")
+    ap.add_argument("--state-dir", help="Use this state directory instead of a fresh temp dir")
+    ap.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = ap.parse_args()
+
+    state_dir = args.state_dir or tempfile.mkdtemp(prefix="ipam-bench-")
+    env = {**os.environ, "IPAM_STATE_DIR": state_dir, "IPAM_TIMING": "1"}
+    reqs = build_workload(args)
+
+    try:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.procs) as pool:
+            results = list(pool.map(lambda q: run_one(q, env), reqs))
+        wall = time.perf_counter() - t0
+
+        state = load_json(os.path.join(state_dir, "ipam_state.json"), {"vpcs": {}, "subnets": {}})
+        problems = verify(results, state)
+    finally:
+        if not args.state_dir:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    def stats(field):
+        vals = [r[field] for r in results if r[field] is not None]
+        return {"p50_ms": round(percentile(vals, 50) * 1000, 2),
+                "p99_ms": round(percentile(vals, 99) * 1000, 2)}
+
+    report = {
+        "procs":          args.procs,
+        "requests":       len(results),
+        "failed":         sum(1 for r in results if not r["ok"]),
+        "wall_s":         round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        "latency":        stats("latency"),
+        "lock_wait":      stats("lock_wait"),
+        "work":           stats("work"),
+        "problems":       problems,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"requests: {report['requests']}  procs: {report['procs']}  failed: {report['failed']}")
+        print(f"wall: {report['wall_s']}s  throughput: {report['throughput_rps']} req/s")
+        for name in ("latency", "lock_wait", "work"):
+            s = report[name]
+            print(f"  {name:<10} p50 {s['p50_ms']:>9.2f} ms   p99 {s['p99_ms']:>9.2f} ms")
+        if problems:
+            print(f"[!] {len(problems)} problem(s):")
+            for p in problems[:20]:
+                print(f"    {p}")
+        else:
+            print("[+] state valid: no overlaps, no lost allocations")
+
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 import sys
+import atexit
 import json
 import ipaddress
 import os
 import time
+import codecs
+import contextlib
 import tempfile
+from bisect import bisect_left, bisect_right
 
 # ─── Fixed Policy ─────────────────────────────────────────────────────────────
 BASE_POOL     = "10.0.0.0/8"   # all VPCs allocated from this pool
@@ -13,8 +17,9 @@ SUBNET_PREFIX = 24             # subnets are always /24
 
 # ─── Paths ────────────────────────────────────────────────────────────────────
 SCRIPT_DIR   = os.path.dirname(os.path.abspath(__file__))
-STATE_FILE   = os.path.join(SCRIPT_DIR, "ipam_state.json")
-LOCK_FILE    = os.path.join(SCRIPT_DIR, "ipam_state.lock")
+STATE_DIR    = os.environ.get("IPAM_STATE_DIR", SCRIPT_DIR)
+STATE_FILE   = os.path.join(STATE_DIR, "ipam_state.json")
+LOCK_FILE    = os.path.join(STATE_DIR, "ipam_state.lock")
 
 # ─── Simple file lock ─────────────────────────────────────────────────────────
 class FileLock:
@@ -23,12 +28,15 @@ class FileLock:
         self.timeout = timeout
         self.poll = poll
         self.fd = None
+        self.requested_at = self.acquired_at = self.released_at = None
 
     def __enter__(self):
         start = time.time()
+        self.requested_at = time.perf_counter()
         while True:
             try:
                 self.fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
+                self.acquired_at = time.perf_counter()
                 return self
             except FileExistsError:
                 if time.time() - start > self.timeout:
@@ -36,6 +44,7 @@ class FileLock:
                 time.sleep(self.poll)
 
     def __exit__(self, exc_type, exc, tb):
+        self.released_at = time.perf_counter()
         try:
             if self.fd is not None:
                 os.close(self.fd)
@@ -64,6 +73,17 @@ def atomic_save_json(path, data):
         tmp_path = tmp.name
     os.replace(tmp_path, path)
 
+def report_timing(lock):
+    # IPAM_TIMING=1: emit lock-wait / work split on stderr (read by ipam_bench.py)
+    if lock.requested_at is None:
+        return
+    acquired = lock.acquired_at or time.perf_counter()
+    released = lock.released_at or acquired
+    print(json.dumps({"ipam_timing": {
+        "lock_wait_s": round(acquired - lock.requested_at, 6),
+        "work_s":      round(released - acquired, 6),
+    }}), file=sys.stderr)
+
 def allocate_next(super_cidr, used, prefix):
     net = ipaddress.ip_network(super_cidr)
     for cand in net.subnets(new_prefix=prefix):
@@ -73,6 +93,402 @@ def allocate_next(super_cidr, used, prefix):
             return c
     raise RuntimeError(f"no free blocks inside {super_cidr} for /{prefix}")
 
+def allocate_vpc(vpcs, vpc_key):
+    used = {entry["cidr"] for entry in vpcs.values()}
+    try:
+        cidr = allocate_next(BASE_POOL, used, VPC_PREFIX)
+    except RuntimeError:
+        print(json.dumps({"error": f"no free /{VPC_PREFIX}s in {BASE_POOL}"}), file=sys.stderr)
+        sys.exit(1)
+    vpcs[vpc_key] = {"cidr": cidr}
+    return cidr
+
+# ─── Interval index (lookup / overlap queries) ─────────────────────────────────
+def cidr_range(cidr):
+    net = ipaddress.ip_network(cidr, strict=False)
+    return int(net.network_address), int(net.broadcast_address)
+
+class IntervalIndex:
+    """Disjoint [lo, hi] integer ranges sorted by start; bisect-backed queries.
+
+    Values are (cidr, owner) tuples. Because the ranges are disjoint, ends are
+    sorted too, so both point and range queries are O(log n + matches).
+    An overlap raises, or with a `conflicts` list is appended there and the
+    later range is left out.
+    """
+    def __init__(self, entries, scope, conflicts=None):
+        items = []
+        for e in sorted(entries, key=lambda e: (e[0], e[1])):
+            if items and e[0] <= items[-1][1]:
+                (c1, o1), (c2, o2) = items[-1][2], e[2]
+                msg = f"overlapping allocations in {scope}: {c1} ({o1}) and {c2} ({o2})"
+                if conflicts is None:
+                    raise RuntimeError(msg)
+                conflicts.append(msg)
+                continue
+            items.append(e)
+        self.starts = [e[0] for e in items]
+        self.ends   = [e[1] for e in items]
+        self.values = [e[2] for e in items]
+
+    def find(self, addr):
+        i = bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr <= self.ends[i]:
+            return self.values[i]
+        return None
+
+    def overlapping(self, lo, hi):
+        out = []
+        i = bisect_left(self.ends, lo)
+        while i < len(self.starts) and self.starts[i] <= hi:
+            out.append(self.values[i])
+            i += 1
+        return out
+
+class AllocationIndex:
+    """Two-level index over the state: VPC ranges, then subnet ranges per VPC.
+
+    Building it validates the state: VPCs must not overlap each other, and each
+    VPC's subnets must lie inside its CIDR without overlapping one another.
+
+    With a reconcile `drift` dict the state is indexed as far as it is valid
+    instead: subnet records for a missing VPC or an older VPC CIDR go to
+    drift["stale_subnets"], everything else to drift["conflicts"].
+    """
+    def __init__(self, state, drift=None):
+        vpcs = state.get("vpcs", {})
+        subs = state.get("subnets", {})
+        conflicts = drift["conflicts"] if drift is not None else None
+
+        def invalid(msg):
+            if drift is None:
+                raise RuntimeError(msg)
+            conflicts.append(msg)
+
+        self.vpcs = IntervalIndex(
+            ((*cidr_range(v["cidr"]), (v["cidr"], k)) for k, v in vpcs.items()),
+            scope="vpcs", conflicts=conflicts,
+        )
+
+        self.subnets = {}
+        for key, alloc in subs.items():
+            vpc_cidr = vpcs.get(key, {}).get("cidr")
+            if vpc_cidr is None or alloc.get("vpc_cidr") != vpc_cidr:
+                if drift is not None:
+                    drift["stale_subnets"].append(key)
+                    continue
+                if vpc_cidr is None:
+                    raise RuntimeError(f"subnets allocated for unknown VPC '{key}'")
+                raise RuntimeError(f"State VPC '{alloc.get('vpc_cidr')}' != current VPC '{vpc_cidr}' for key '{key}'")
+            vlo, vhi = cidr_range(vpc_cidr)
+            entries = []
+            for tier in ("public", "private"):
+                for c in alloc.get(tier, []):
+                    lo, hi = cidr_range(c)
+                    if lo < vlo or hi > vhi:
+                        invalid(f"subnet {c} ({tier}) lies outside VPC {vpc_cidr} for key '{key}'")
+                        continue
+                    entries.append((lo, hi, (c, tier)))
+            self.subnets[key] = IntervalIndex(entries, scope=f"subnets of '{key}'", conflicts=conflicts)
+
+    def lookup(self, address):
+        addr = int(ipaddress.ip_address(address))
+        vpc = self.vpcs.find(addr)
+        if vpc is None:
+            return None, None
+        vpc_cidr, vpc_key = vpc
+        sub_index = self.subnets.get(vpc_key)
+        return vpc, (sub_index.find(addr) if sub_index else None)
+
+    def overlap(self, cidr):
+        lo, hi = cidr_range(cidr)
+        vpc_hits = self.vpcs.overlapping(lo, hi)
+        sub_hits = []
+        for _vpc_cidr, vpc_key in vpc_hits:
+            sub_index = self.subnets.get(vpc_key)
+            if sub_index:
+                sub_hits.extend(sub_index.overlapping(lo, hi))
+        return vpc_hits, sub_hits
+
+def query(mode, q):
+    # Read-only: atomic_save_json replaces the file in one step, so no lock needed.
+    state = load_json(STATE_FILE, {"vpcs": {}, "subnets": {}})
+    index = AllocationIndex(state)
+
+    # external data sources only accept flat string maps
+    if mode == "lookup":
+        address = q.get("address", "").strip()
+        if ipaddress.ip_address(address).version != 4:
+            raise ValueError(f"only IPv4 addresses can be looked up: {address}")
+        vpc, sub = index.lookup(address)
+        return {
+            "address":     address,
+            "found":       "true" if vpc else "false",
+            "vpc_key":     vpc[1] if vpc else "",
+            "vpc_cidr":    vpc[0] if vpc else "",
+            "subnet_cidr": sub[0] if sub else "",
+            "tier":        sub[1] if sub else "",
+        }
+
+    cidr = q.get("cidr", "").strip()
+    if ipaddress.ip_network(cidr, strict=False).version != 4:
+        raise ValueError(f"only IPv4 networks can be checked for overlap: {cidr}")
+    vpc_hits, sub_hits = index.overlap(cidr)
+    return {
+        "cidr":      cidr,
+        "overlaps":  "true" if vpc_hits else "false",
+        "vpcs":      ",".join(k for _c, k in vpc_hits),
+        "vpc_cidrs": ",".join(c for c, _k in vpc_hits),
+        "subnets":   ",".join(c for c, _t in sub_hits),
+    }
+
+# ─── Terraform state streaming (reconcile) ────────────────────────────────────
+class JsonStream:
+    """Incremental reader over a text stream; decodes one JSON value at a time.
+
+    Only the value being decoded is held in memory, so a state file's
+    `resources` array can be walked element by element.
+    """
+    def __init__(self, reader, chunk_size=1 << 16):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self):
+        if self.eof:
+            return False
+        # grow geometrically so a large value isn't re-parsed once per chunk
+        data = self.reader.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ""
+
+    def take(self, allowed):
+        c = self.peek()
+        if c == "" or c not in allowed:
+            raise ValueError(f"malformed Terraform state: expected one of {allowed!r}, got {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+            # a number ending exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and self._more():
+                continue
+            self.pos = end
+            return v
+
+def iter_tf_resources(reader):
+    s = JsonStream(reader)
+    s.take("{")
+    if s.peek() == "}":
+        return
+    while True:
+        key = s.value()
+        s.take(":")
+        if key == "resources":
+            s.take("[")
+            if s.peek() == "]":
+                s.take("]")
+            else:
+                while True:
+                    yield s.value()
+                    if s.take(",]") == "]":
+                        break
+        else:
+            s.value()
+        if s.take(",}") == "}":
+            return
+
+def open_state_source(src, s3=None):
+    if src.startswith("s3://"):
+        bucket, _, key = src[len("s3://"):].partition("/")
+        if s3 is None:
+            # only needed for s3:// sources; AWS_ENDPOINT_URL_S3 points it at a stand-in
+            try:
+                import boto3
+            except ImportError as e:
+                raise ValueError(f"reading s3:// states needs boto3 on the Terraform runner ({src})") from e
+            s3 = boto3.client("s3")
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+        return codecs.getreader("utf-8")(body)
+    return open(src, "r", encoding="utf-8")
+
+def observed_networks(resource):
+    rtype = resource.get("type")
+    if resource.get("mode") != "managed" or rtype not in ("aws_vpc", "aws_subnet"):
+        return
+    for inst in resource.get("instances", []):
+        attrs = inst.get("attributes") or {}
+        if not attrs.get("cidr_block"):
+            continue
+        yield rtype, {
+            "cidr":   str(ipaddress.ip_network(attrs["cidr_block"], strict=False)),
+            "name":   (attrs.get("tags") or {}).get("Name", ""),
+            "public": bool(attrs.get("map_public_ip_on_launch")),
+        }
+
+def scan_tf_states(sources, s3=None):
+    vpcs, subnets = {}, {}   # cidr -> record, deduplicated across state files
+    for src in sources:
+        with contextlib.closing(open_state_source(src, s3)) as reader:
+            for resource in iter_tf_resources(reader):
+                for rtype, rec in observed_networks(resource):
+                    (vpcs if rtype == "aws_vpc" else subnets).setdefault(rec["cidr"], rec)
+    return vpcs, subnets
+
+def in_scope(key, scope):
+    return any(key.startswith(prefix) for prefix in scope)
+
+def diff_allocations(state, obs_vpcs, obs_subnets, env, scope=None):
+    """Diff the allocations against the observed networks.
+
+    Only allocated keys starting with one of the `scope` prefixes are orphans
+    that apply may reclaim. Without an explicit scope it is the envs ("env|")
+    of the allocations the scanned states still use, so a state that covers one
+    env never reclaims another env's blocks. Unreferenced keys outside the
+    scope are still reported, as "unscoped_orphans".
+
+    Drift in the state itself (see AllocationIndex) is reported rather than
+    raised, so a damaged state can still be reconciled.
+    """
+    allocated = state.get("vpcs", {})
+    diff = {"orphan_vpcs": [], "unscoped_orphans": [], "orphan_subnets": [], "stale_subnets": [],
+            "import_vpcs": {}, "import_subnets": [], "conflicts": []}
+    index = AllocationIndex(state, drift=diff)
+    live, seen_subnets, unknown = set(), set(), []
+    keys_by_cidr = {}   # also covers VPCs left out of the index as conflicting
+    for k, v in allocated.items():
+        keys_by_cidr.setdefault(v["cidr"], []).append(k)
+
+    for cidr, rec in sorted(obs_vpcs.items()):
+        lo, hi = cidr_range(cidr)
+        if cidr in keys_by_cidr:
+            live.update(keys_by_cidr[cidr])
+            continue
+        hits = index.vpcs.overlapping(lo, hi)
+        if hits:
+            diff["conflicts"].append(f"vpc {cidr} overlaps allocated {','.join(c for c, _k in hits)}")
+            continue
+        key = f"{env}|{rec['name']}"
+        if not rec["name"] or key in allocated or key in diff["import_vpcs"]:
+            diff["conflicts"].append(f"vpc {cidr} cannot be imported as '{key}'")
+            continue
+        diff["import_vpcs"][key] = cidr
+        unknown.append((lo, hi, (cidr, key)))
+    imported = IntervalIndex(unknown, scope="imported vpcs")
+
+    for cidr, rec in sorted(obs_subnets.items()):
+        lo, hi = cidr_range(cidr)
+        owner = index.vpcs.find(lo) or imported.find(lo)
+        if owner is None or cidr_range(owner[0])[1] < hi:
+            diff["conflicts"].append(f"subnet {cidr} lies outside every VPC")
+            continue
+        key = owner[1]
+        live.add(key)   # a live subnet keeps its VPC allocation even if the VPC is in another state
+        sub_index = index.subnets.get(key)
+        hits = sub_index.overlapping(lo, hi) if sub_index else []
+        if any(c == cidr for c, _t in hits):
+            seen_subnets.add((key, cidr))
+        elif hits:
+            diff["conflicts"].append(f"subnet {cidr} overlaps allocated {','.join(c for c, _t in hits)} in '{key}'")
+        else:
+            diff["import_subnets"].append((key, cidr, "public" if rec["public"] else "private"))
+
+    if scope is None:
+        scope = sorted({k.split("|", 1)[0] + "|" for k in live})
+    diff["scope"] = list(scope)
+    unreferenced = set(allocated) - live
+    diff["orphan_vpcs"] = sorted(k for k in unreferenced if in_scope(k, scope))
+    diff["unscoped_orphans"] = sorted(k for k in unreferenced if not in_scope(k, scope))
+    stale = set(diff["stale_subnets"])
+    diff["stale_subnets"] = sorted(k for k in stale if in_scope(k, scope))
+    for key in sorted((live & set(allocated)) - stale):
+        alloc = state.get("subnets", {}).get(key, {})
+        for tier in ("public", "private"):
+            diff["orphan_subnets"].extend(
+                (key, c, tier) for c in alloc.get(tier, []) if (key, c) not in seen_subnets
+            )
+    return diff
+
+def apply_reconcile(state, diff):
+    vpcs = state.setdefault("vpcs", {})
+    subs = state.setdefault("subnets", {})
+    # Reclaim whole VPC blocks only. Orphaned subnets of live VPCs are reported but
+    # kept: the subnet lists are positional (privates[0], ...) in the ipam module.
+    for key in diff["orphan_vpcs"]:
+        vpcs.pop(key, None)
+        subs.pop(key, None)
+    for key in diff["stale_subnets"]:
+        subs.pop(key, None)
+    for key, cidr in diff["import_vpcs"].items():
+        vpcs[key] = {"cidr": cidr}
+    for key, cidr, tier in diff["import_subnets"]:
+        alloc = subs.setdefault(
+            key,
+            {"vpc_cidr": vpcs[key]["cidr"], "public": [], "private": [], "prefix": SUBNET_PREFIX}
+        )
+        alloc[tier].append(cidr)
+    AllocationIndex(state)   # refuse to save an inconsistent result
+
+def reconcile(q, lock, s3=None):
+    sources = [s.strip() for s in q.get("states", "").split(",") if s.strip()]
+    if not sources:
+        raise ValueError("reconcile needs 'states': comma-separated paths or s3:// URIs")
+    action = q.get("action", "report").strip()
+    if action not in ("report", "apply"):
+        raise ValueError(f"unknown reconcile action: {action}")
+    scope = [p.strip() for p in q["scope"].split(",") if p.strip()] if q.get("scope") else None
+    force = q.get("force", "false").strip().lower() == "true"
+
+    # stream the (possibly large) states before taking the lock
+    obs_vpcs, obs_subnets = scan_tf_states(sources, s3)
+    if action == "apply" and not obs_vpcs and not force:
+        raise ValueError("no VPCs found in the supplied states; refusing to apply (set force=true to reclaim anyway)")
+
+    with lock:
+        state = load_json(STATE_FILE, {"vpcs": {}, "subnets": {}})
+        diff = diff_allocations(state, obs_vpcs, obs_subnets, q.get("env", "default").strip(), scope)
+        if action == "apply":
+            apply_reconcile(state, diff)
+            atomic_save_json(STATE_FILE, state)
+
+    return {
+        "action":           action,
+        "vpcs_seen":        str(len(obs_vpcs)),
+        "subnets_seen":     str(len(obs_subnets)),
+        "scope":            ",".join(diff["scope"]),
+        "orphan_vpcs":      ",".join(diff["orphan_vpcs"]),
+        "unscoped_orphans": ",".join(diff["unscoped_orphans"]),
+        "orphan_subnets":   ",".join(f"{k}={c}({t})" for k, c, t in diff["orphan_subnets"]),
+        "stale_subnets":    ",".join(diff["stale_subnets"]),
+        "import_vpcs":      ",".join(f"{k}={c}" for k, c in diff["import_vpcs"].items()),
+        "import_subnets":   ",".join(f"{k}={c}({t})" for k, c, t in diff["import_subnets"]),
+        "conflicts":        "; ".join(diff["conflicts"]),
+    }
+
 # ─── Main ─────────────────────────────────────────────────────────────────────
 def main():
     q         = json.load(sys.stdin)
@@ -82,7 +498,29 @@ def main():
 
     vpc_key = f"{env}|{vpc_name}"
 
-    with FileLock(LOCK_FILE):
+    # ─ Queries (lookup / overlap) ─────────────────────────────────────────────
+    if mode in ("lookup", "overlap"):
+        try:
+            print(json.dumps(query(mode, q)))
+        except (RuntimeError, ValueError) as e:
+            print(json.dumps({"error": str(e)}), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    lock = FileLock(LOCK_FILE)
+    if os.environ.get("IPAM_TIMING"):
+        atexit.register(report_timing, lock)
+
+    # ─ Reconcile against Terraform state ──────────────────────────────────────
+    if mode == "reconcile":
+        try:
+            print(json.dumps(reconcile(q, lock)))
+        except (RuntimeError, ValueError, OSError) as e:
+            print(json.dumps({"error": str(e)}), file=sys.stderr)
+            sys.exit(1)
+        return
+
+    with lock:
         state = load_json(STATE_FILE, {"vpcs": {}, "subnets": {}})
         vpcs = state.setdefault("vpcs", {})
         subs = state.setdefault("subnets", {})
@@ -92,18 +530,7 @@ def main():
             if vpc_key in vpcs:
                 cidr = vpcs[vpc_key]["cidr"]
             else:
-                supernet = ipaddress.ip_network(BASE_POOL)
-                used = {entry["cidr"] for entry in vpcs.values()}
-                cidr = None
-                for cand in supernet.subnets(new_prefix=VPC_PREFIX):
-                    c = str(cand)
-                    if c not in used:
-                        cidr = c
-                        vpcs[vpc_key] = {"cidr": cidr}
-                        break
-                if cidr is None:
-                    print(json.dumps({"error": "no free /16s in 10.0.0.0/8"}), file=sys.stderr)
-                    sys.exit(1)
+                cidr = allocate_vpc(vpcs, vpc_key)
 
             atomic_save_json(STATE_FILE, state)
             print(json.dumps({"cidr": cidr}))
@@ -116,18 +543,8 @@ def main():
                 print(f"VPC '{vpc_key}' not found, attempting to allocate it first...", file=sys.stderr)
                 
                 # Allocate VPC
-                supernet = ipaddress.ip_network(BASE_POOL)
-                used = {entry["cidr"] for entry in vpcs.values()}
-                cidr = None
-                for c in supernet.subnets(new_prefix=VPC_PREFIX):
-                    if c not in used:
-                        cidr = c
-                        vpcs[vpc_key] = {"cidr": cidr}
-                        break
-                if cidr is None:
-                    print(json.dumps({"error": "no free /16s in 10.0.0.0/8"}), file=sys.stderr)
-                    sys.exit(1)
-                
+                cidr = allocate_vpc(vpcs, vpc_key)
+
                 # Save the VPC allocation
                 atomic_save_json(STATE_FILE, state)
                 print(f"VPC '{vpc_key}' allocated with CIDR {cidr}", file=sys.stderr)
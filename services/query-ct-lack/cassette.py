@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Record / replay of AWS API responses through botocore's event system.
+
+Recorder hooks `before-parameter-build` (to key the call by service, region,
+operation and request params) and `after-call` (to capture the parsed
+response) on every client it is attached to. Replayer answers `before-call`
+with the recorded response, so botocore never signs or sends a request and
+no credentials or network are needed.
+
+Cassette layout (one directory per run):
+  meta.json               run metadata (pipeline end time, default region)
+  <service>.jsonl.gz      one {"key", "status", "response"} line per call
+
+Repeated identical calls (e.g. get_generated_policy polling) are replayed in
+recorded order; once exhausted, the last recording is served again.
+"""
+import base64
+import datetime as dt
+import gzip
+import hashlib
+import io
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+META_FILE = "meta.json"
+
+class CassetteMiss(RuntimeError):
+    pass
+
+def _call_key(region: Optional[str], model: Any, params: Dict[str, Any]) -> str:
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{model.service_model.service_name}.{region or '-'}.{model.name}.{digest}"
+
+# -------------------------
+# Response (de)serialization
+# -------------------------
+def _encode(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: _encode(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_encode(v) for v in obj]
+    if isinstance(obj, dt.datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(obj)).decode()}
+    return obj
+
+def _decode(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        if "__datetime__" in obj:
+            return dt.datetime.fromisoformat(obj["__datetime__"])
+        if "__bytes__" in obj:
+            return base64.b64decode(obj["__bytes__"])
+        if "__stream__" in obj:
+            from botocore.response import StreamingBody
+            data = base64.b64decode(obj["__stream__"])
+            return StreamingBody(io.BytesIO(data), len(data))
+        return {k: _decode(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    return obj
+
+def _drain_streams(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Read streaming bodies into the recording and hand the caller a fresh stream."""
+    encoded = {}
+    for k, v in list(parsed.items()):
+        if hasattr(v, "read") and callable(v.read):
+            from botocore.response import StreamingBody
+            data = v.read()
+            parsed[k] = StreamingBody(io.BytesIO(data), len(data))
+            encoded[k] = {"__stream__": base64.b64encode(data).decode()}
+    return encoded
+
+# -------------------------
+# Recorder / Replayer
+# -------------------------
+class Recorder:
+    def __init__(self, path: str, meta: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.meta = dict(meta or {})
+        self._calls: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+    def attach(self, client: Any) -> None:
+        region = client.meta.region_name
+        events = client.meta.events
+
+        def key_call(params, model, context, **_kwargs):
+            context["cassette_key"] = _call_key(region, model, params)
+
+        def record(http_response, parsed, model, context, **_kwargs):
+            key = context.get("cassette_key")
+            if key is None:
+                return
+            streams = _drain_streams(parsed)
+            self._calls[model.service_model.service_name].append({
+                "key": key,
+                "status": getattr(http_response, "status_code", 200),
+                "response": {**_encode(parsed), **streams},
+            })
+
+        # first, so the key sees the caller's params before botocore injects idempotency tokens
+        events.register_first("before-parameter-build", key_call)
+        events.register("after-call", record)
+
+    def close(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        for service, calls in self._calls.items():
+            with gzip.open(os.path.join(self.path, f"{service}.jsonl.gz"), "wt") as f:
+                for c in calls:
+                    f.write(json.dumps(c, default=str) + "\n")
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump({**self.meta, "calls": sum(len(c) for c in self._calls.values())}, f, indent=2)
+
+class Replayer:
+    def __init__(self, path: str):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            raise SystemExit(f"No cassette at {path} (missing {META_FILE})")
+        with open(meta_path, "r") as f:
+            self.meta = json.load(f)
+        self._calls: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._served: Dict[str, int] = defaultdict(int)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".jsonl.gz"):
+                with gzip.open(os.path.join(path, name), "rt") as f:
+                    for line in f:
+                        c = json.loads(line)
+                        self._calls[c["key"]].append(c)
+
+    def attach(self, client: Any) -> None:
+        from botocore.awsrequest import AWSResponse
+        region = client.meta.region_name
+        events = client.meta.events
+
+        def key_call(params, model, context, **_kwargs):
+            context["cassette_key"] = _call_key(region, model, params)
+
+        def serve(model, context, **_kwargs):
+            key = context.get("cassette_key")
+            recorded = self._calls.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded response for {model.name} ({key}) in {self.path}")
+            i = min(self._served[key], len(recorded) - 1)
+            self._served[key] += 1
+            c = recorded[i]
+            return AWSResponse(url="", status_code=c["status"], headers={}, raw=None), _decode(c["response"])
+
+        events.register_first("before-parameter-build", key_call)
+        events.register("before-call", serve)
+
+    def close(self) -> None:
+        pass
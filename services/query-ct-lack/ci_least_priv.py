@@ -3,14 +3,18 @@ import argparse
 import json
 import time
 import datetime as dt
-from typing import Any, Dict, List, Optional, Set, Tuple, Iterable
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Iterable
 import re
 from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+import multiprocessing
 import os
+import threading
 
-import boto3
-from botocore.exceptions import ClientError
-import botocore
+# boto3 is imported where a session is first needed, so offline stages
+# (--from-stage merge/policy) start without loading it.
+from cassette import Recorder, Replayer
+from policy_coverage import event_action, event_resource_arns, evaluate as evaluate_coverage
 
 # -------------------------
 # Noise filtering
@@ -26,6 +30,14 @@ NOISE_PREFIXES = (
 
 DEFAULT_PRESERVE_SIDS = {"S3StateManagement"}
 
+def keep_action(action: str) -> bool:
+    if action in NOISE_ACTIONS:
+        return False
+    for p in NOISE_PREFIXES:
+        if action.startswith(p):
+            return False
+    return True
+
 # -------------------------
 # Small utils
 # -------------------------
@@ -35,8 +47,83 @@ def jdump(obj: Any) -> str:
     except Exception:
         return str(obj)
 
+_log_ctx = threading.local()  # org mode sets .prefix per worker, e.g. "[123456789012] "
+
 def log(msg: str) -> None:
-    print(msg, flush=True)
+    print(f"{getattr(_log_ctx, 'prefix', '')}{msg}", flush=True)
+
+# -------------------------
+# AWS clients (per-session reuse + global rate limit)
+# -------------------------
+class RateLimiter:
+    """Spaces API calls to at most `rate` per second across all worker processes."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = multiprocessing.Value("d", 0.0)  # shared slot clock, carries its own lock
+
+    def wait(self, **_kwargs: Any) -> None:
+        with self._next.get_lock():
+            now = time.time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class AwsClients:
+    """
+    Clients of one session, created once per (service, region) and reused.
+    The session itself (default boto3 session, or `session_factory()`) is only
+    created when the first client is requested.
+    """
+    def __init__(self, session: Any = None, limiter: Optional[RateLimiter] = None,
+                 cassette: Optional[Any] = None, session_factory: Optional[Callable[[], Any]] = None):
+        self._session = session
+        self._session_factory = session_factory
+        self.limiter = limiter
+        self.cassette = cassette  # Recorder / Replayer for --record / --replay
+        self._cache: Dict[Tuple[str, Optional[str]], Any] = {}
+
+    @property
+    def session(self) -> Any:
+        if self._session is None:
+            if self._session_factory is not None:
+                self._session = self._session_factory()
+            else:
+                import boto3
+                self._session = boto3.session.Session()
+        return self._session
+
+    @property
+    def region_name(self) -> Optional[str]:
+        return getattr(self.session, "region_name", None)
+
+    def client(self, service: str, region_name: Optional[str] = None) -> Any:
+        key = (service, region_name)
+        c = self._cache.get(key)
+        if c is None:
+            if self.cassette is not None:
+                self.cassette.meta.setdefault("region", self.region_name)
+            c = self.session.client(service, region_name=region_name) if region_name else self.session.client(service)
+            events = getattr(getattr(c, "meta", None), "events", None)
+            if self.limiter is not None and events is not None:
+                events.register("before-call", self.limiter.wait)
+            if self.cassette is not None:
+                self.cassette.attach(c)
+            self._cache[key] = c
+        return c
+
+def open_cassette(args: argparse.Namespace, account_id: Optional[str] = None) -> Optional[Any]:
+    path = args.record or args.replay
+    if not path:
+        return None
+    if account_id:
+        path = os.path.join(path, account_id)
+    return Recorder(path) if args.record else Replayer(path)
+
+def replay_session(cassette: Replayer) -> Any:
+    # no credentials needed: every call is answered from the cassette before signing
+    import boto3
+    return boto3.session.Session(region_name=cassette.meta.get("region") or "us-east-1")
 
 # -------------------------
 # Access Analyzer helpers
@@ -216,17 +303,19 @@ def extract_candidate_strings_from_event(detail: Dict[str, Any]) -> Set[str]:
     harvest_kv(detail.get("responseElements") or {})
     return out
 
-def resource_explorer_search_strings(strings: Set[str], regions: Optional[List[str]] = None) -> Set[str]:
+def resource_explorer_search_strings(strings: Set[str], regions: Optional[List[str]] = None,
+                                     clients: Optional[AwsClients] = None) -> Set[str]:
     arns: Set[str] = set()
     candidate_regions = regions or []
-    if not candidate_regions:
-        try:
-            candidate_regions = [boto3.session.Session().region_name or "us-east-1"]
-        except Exception:
-            candidate_regions = ["us-east-1"]
+    try:
+        clients = clients or AwsClients()
+        if not candidate_regions:
+            candidate_regions = [clients.region_name or "us-east-1"]
+    except Exception:
+        candidate_regions = candidate_regions or ["us-east-1"]
     for reg in dict.fromkeys(candidate_regions):
         try:
-            rex = boto3.client("resource-explorer-2", region_name=reg)
+            rex = clients.client("resource-explorer-2", region_name=reg)
         except Exception:
             continue
         for s in strings:
@@ -246,9 +335,7 @@ def resource_explorer_search_strings(strings: Set[str], regions: Optional[List[s
                         if isinstance(arn, str) and arn.startswith("arn:aws"):
                             arns.add(arn)
                     token = resp.get("NextToken")
-            except botocore.exceptions.ClientError:
-                continue
-            except Exception:
+            except Exception:  # ClientError, throttling, ...: skip this string
                 continue
     return arns
 
@@ -263,7 +350,14 @@ def bucketize_arns(arns: Set[str]) -> Dict[str, Set[str]]:
 # -------------------------
 # CloudTrail → evidence (generic)
 # -------------------------
-def collect_used_arns_from_cloudtrail_generic(cloudtrail, principal_arn: str, start: dt.datetime, end: dt.datetime) -> Dict[str, Set[str]]:
+def collect_used_arns_from_cloudtrail_generic(cloudtrail, principal_arn: str, start: dt.datetime, end: dt.datetime,
+                                              pairs: Optional[Set[Tuple[str, Optional[str]]]] = None,
+                                              clients: Optional[AwsClients] = None) -> Dict[str, Set[str]]:
+    """
+    Bucketized ARNs the principal touched. If `pairs` is given, it is filled with
+    the observed (action, resource ARN) pairs; resource is None when the event
+    carried no ARN.
+    """
     found_arns: Set[str] = set()
     id_or_name_candidates: Set[str] = set()
     trail_regions: Set[str] = set()
@@ -306,13 +400,24 @@ def collect_used_arns_from_cloudtrail_generic(cloudtrail, principal_arn: str, st
                     if isinstance(rn, str) and rn:
                         id_or_name_candidates.add(rn)
 
-            id_or_name_candidates |= extract_candidate_strings_from_event(detail)
+            candidates = extract_candidate_strings_from_event(detail)
+            id_or_name_candidates |= candidates
+
+            if pairs is not None:
+                action = event_action(detail)
+                if action:
+                    # only the event's own resources: harvested ids may belong to other calls' targets
+                    event_arns = event_resource_arns(detail, action)
+                    if event_arns:
+                        pairs.update((action, a) for a in event_arns)
+                    else:
+                        pairs.add((action, None))
 
         next_token = resp.get("NextToken")
         if not next_token:
             break
 
-    resolved = resource_explorer_search_strings(id_or_name_candidates, regions=list(trail_regions) or None)
+    resolved = resource_explorer_search_strings(id_or_name_candidates, regions=list(trail_regions) or None, clients=clients)
     found_arns |= resolved
 
     return bucketize_arns(found_arns)
@@ -337,18 +442,25 @@ def parse_backend_tf(path: str) -> Optional[Tuple[str, str, str]]:
         return (b.group(1), k.group(1), r.group(1))
     return None
 
-def load_tf_state_from_backend(backend_path: str) -> Optional[Dict[str, Any]]:
+def load_tf_state_from_backend(backend_path: str, clients: Optional[AwsClients] = None,
+                               strict: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Terraform state from the S3 backend in backend.tf, or None without one.
+    A failed read is logged and returns None, or raises RuntimeError when `strict`.
+    """
     cfg = parse_backend_tf(backend_path)
     if not cfg:
         log("[*] No backend.tf found or could not parse S3 backend; skipping TF state.")
         return None
     bucket, key, region = cfg
     log(f"[*] Reading Terraform state from s3://{bucket}/{key} (region {region})")
-    s3 = boto3.client("s3", region_name=region)
     try:
+        s3 = (clients or AwsClients()).client("s3", region_name=region)
         obj = s3.get_object(Bucket=bucket, Key=key)
         return json.loads(obj["Body"].read())
     except Exception as e:
+        if strict:
+            raise RuntimeError(f"Failed to read Terraform state s3://{bucket}/{key}: {e}") from e
         log(f"[!] Failed to read Terraform state: {e}")
         return None
 
@@ -470,31 +582,99 @@ def wildcardize_variable_resources(statements: List[Dict[str, Any]],
     return out
 
 # -------------------------
-# Main
+# Run directory: stage checkpoints
 # -------------------------
-def main() -> None:
-    ap = argparse.ArgumentParser(description="Generate least-priv IAM policy via IAM Access Analyzer from CloudTrail evidence")
-    ap.add_argument("--principal-arn", required=True, help="Role/User ARN to analyze")
-    ap.add_argument("--policy-path", required=True, help="File to write the generated JSON policy")
-    ap.add_argument("--lookback-hours", type=int, default=24, help="Hours to analyze (max 2160)")
-    ap.add_argument("--trail-arn", help="CloudTrail trail ARN (optional)")
-    ap.add_argument("--access-role-arn", help="IAM role AA assumes to read the trail's S3 bucket (optional)")
-    ap.add_argument("--regions", default="", help="CSV regions for the trail; omit to use allRegions=true")
-    ap.add_argument("--keep-star-resources", action="store_true", help="Keep statements with Resource:'*' (default: drop)")
-    ap.add_argument("--preserve-sids", default=",".join(sorted(DEFAULT_PRESERVE_SIDS)),
-                    help="Comma-separated list of Sid values to preserve from existing policy file")
-    ap.add_argument("--backend-path", default="backend.tf", help="Path to Terraform backend.tf for auto-loading S3 state")
-    ap.add_argument("--evidence-source", choices=["cloudtrail", "tfstate", "union", "intersection"], default="union",
-                    help="Which evidence to use when replacing placeholders (default: union)")
-    ap.add_argument("--drop-unresolved-placeholders", action="store_true",
-                    help="Drop statements that still contain ${...} after replacement")
-    args = ap.parse_args()
+STAGES = ("generate", "cloudtrail", "tfstate", "merge", "policy")
+STAGE_FILES = {
+    "generate":   "generated-policy.json",
+    "cloudtrail": "cloudtrail-evidence.json",
+    "tfstate":    "state-evidence.json",
+    "merge":      "merged-evidence.json",
+    "policy":     "final-policy.json",
+}
+# args each stage's output depends on; a checkpoint made with other values is stale
+STAGE_INPUTS = {
+    "generate":   ("principal_arn", "lookback_hours", "trail_arn", "access_role_arn", "regions"),
+    "cloudtrail": ("principal_arn", "lookback_hours"),
+    "tfstate":    ("backend_path",),
+    "merge":      ("evidence_source",),
+    "policy":     ("policy_path", "keep_star_resources", "preserve_sids", "drop_unresolved_placeholders"),
+}
+RUN_FILE = "run.json"
 
-    end = dt.datetime.utcnow().replace(microsecond=0)
-    start = end - dt.timedelta(hours=args.lookback_hours)
+def evidence_to_json(evidence: Dict[str, Set[str]]) -> Dict[str, List[str]]:
+    return {k: sorted(v) for k, v in sorted(evidence.items())}
+
+def evidence_from_json(data: Dict[str, List[str]]) -> Dict[str, Set[str]]:
+    return {k: set(v) for k, v in data.items()}
 
-    access = boto3.client("accessanalyzer")
-    cloudtrail = boto3.client("cloudtrail")
+class RunDir:
+    """<stage file>.json checkpoints plus the pinned analysis window (run.json).
+
+    Every checkpoint records the window end it was made for; one from another
+    run's window is stale even when its inputs match.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.end_time: Optional[str] = None
+
+    def _read(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.path, name), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            log(f"[!] Warning: checkpoint {name} in {self.path} is not valid JSON; ignoring.")
+            return None
+
+    def _write(self, name: str, obj: Any) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, name)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(obj, f, indent=2, default=str)
+        os.replace(tmp, path)
+
+    def pinned_end(self) -> Optional[str]:
+        run = self._read(RUN_FILE)
+        return run.get("end_time") if run else None
+
+    def pin(self, end: dt.datetime) -> None:
+        self.end_time = end.isoformat()
+        self._write(RUN_FILE, {"end_time": self.end_time})
+
+    def load(self, stage: str, args: argparse.Namespace) -> Optional[Any]:
+        cp = self._read(STAGE_FILES[stage])
+        if cp is None:
+            return None
+        if cp.get("end_time") != self.end_time:
+            log(f"[*] Stage {stage}: checkpoint belongs to another run window; ignoring it")
+            return None
+        if cp.get("inputs") != stage_inputs(stage, args):
+            log(f"[*] Stage {stage}: checkpoint was made with different inputs; ignoring it")
+            return None
+        return cp.get("data")
+
+    def discard(self, stage: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, STAGE_FILES[stage]))
+        except FileNotFoundError:
+            pass
+
+    def save(self, stage: str, args: argparse.Namespace, data: Any) -> None:
+        self._write(STAGE_FILES[stage], {"stage": stage, "end_time": self.end_time,
+                                         "inputs": stage_inputs(stage, args), "data": data})
+
+def stage_inputs(stage: str, args: argparse.Namespace) -> Dict[str, Any]:
+    return {k: getattr(args, k, None) for k in STAGE_INPUTS[stage]}
+
+# -------------------------
+# Pipeline stages (one principal, one account)
+# -------------------------
+def stage_generate(args: argparse.Namespace, clients: AwsClients,
+                   start: dt.datetime, end: dt.datetime, _outputs: Dict[str, Any]) -> Dict[str, Any]:
+    access = clients.client("accessanalyzer")
 
     cloudtrail_details = build_cloudtrail_details(args, start, end)
     params = {"policyGenerationDetails": {"principalArn": args.principal_arn}, "cloudTrailDetails": cloudtrail_details}
@@ -502,14 +682,14 @@ def main() -> None:
 
     try:
         resp = access.start_policy_generation(**params)
-    except ClientError as e:
+    except Exception as e:  # ClientError / ParamValidationError
         log(f"[!] start_policy_generation failed: {e}")
         raise
 
     job_id = resp["jobId"]
     log(f"[+] Started Access Analyzer policy generation job: {job_id}")
 
-    result = wait_policy(access, job_id)
+    result = wait_policy(access, job_id, poll_s=0 if args.replay else 4)
     status = result["jobDetails"]["status"]
     if status != "SUCCEEDED":
         log(f"[!] Access Analyzer generation failed with status: {status}")
@@ -527,22 +707,46 @@ def main() -> None:
             policy_data = json.loads(policy_data)
         except json.JSONDecodeError as e:
             raise SystemExit(f"Failed to parse generated policy JSON: {e}")
+    return policy_data
+
+def stage_cloudtrail(args: argparse.Namespace, clients: AwsClients,
+                     start: dt.datetime, end: dt.datetime, _outputs: Dict[str, Any]) -> Dict[str, Any]:
+    observed_pairs: Set[Tuple[str, Optional[str]]] = set()
+    used_ct = collect_used_arns_from_cloudtrail_generic(clients.client("cloudtrail"), args.principal_arn, start, end,
+                                                        pairs=observed_pairs, clients=clients)
+    return {
+        "evidence": evidence_to_json(used_ct),
+        "pairs": sorted(([a, r] for a, r in observed_pairs), key=lambda p: (p[0], p[1] or "")),
+    }
+
+def stage_tfstate(args: argparse.Namespace, clients: AwsClients,
+                  _start: dt.datetime, _end: dt.datetime, _outputs: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        tf_state = load_tf_state_from_backend(args.backend_path, clients=clients, strict=True)
+    except RuntimeError as e:
+        if args.evidence_source in ("tfstate", "intersection"):
+            raise SystemExit(str(e))
+        # carry on without state evidence, but don't checkpoint it so --resume retries the read
+        log(f"[!] {e}; continuing without Terraform state evidence")
+        return {"evidence": {}, "incomplete": True}
+    used_tf = arns_from_tf_state_generic(tf_state) if tf_state else {}
+    return {"evidence": evidence_to_json(used_tf)}
 
-    statements = policy_data.get("Statement", [])
+def stage_merge(args: argparse.Namespace, _clients: AwsClients,
+                _start: dt.datetime, _end: dt.datetime, outputs: Dict[str, Any]) -> Dict[str, Any]:
+    used_ct = evidence_from_json(outputs["cloudtrail"]["evidence"])
+    used_tf = evidence_from_json(outputs["tfstate"]["evidence"])
+    return {"evidence": evidence_to_json(merge_evidence(used_ct, used_tf, mode=args.evidence_source))}
+
+def stage_policy(args: argparse.Namespace, _clients: AwsClients,
+                 _start: dt.datetime, _end: dt.datetime, outputs: Dict[str, Any]) -> Dict[str, Any]:
+    statements = outputs["generate"].get("Statement", [])
     if not isinstance(statements, list):
         statements = [statements]
 
     # ----------------------------------
     # Filter noise
     # ----------------------------------
-    def keep_action(action: str) -> bool:
-        if action in NOISE_ACTIONS:
-            return False
-        for p in NOISE_PREFIXES:
-            if action.startswith(p):
-                return False
-        return True
-
     filtered: List[Dict[str, Any]] = []
     for s in statements:
         acts = s.get("Action")
@@ -559,11 +763,7 @@ def main() -> None:
     # ----------------------------------
     # Generic placeholder replacement using CloudTrail + TF state evidence
     # ----------------------------------
-    used_ct = collect_used_arns_from_cloudtrail_generic(cloudtrail, args.principal_arn, start, end)
-    tf_state = load_tf_state_from_backend(args.backend_path)
-    used_tf = arns_from_tf_state_generic(tf_state) if tf_state else {}
-    evidence = merge_evidence(used_ct, used_tf, mode=args.evidence_source)
-
+    evidence = evidence_from_json(outputs["merge"]["evidence"])
     preserve_sids = {s.strip() for s in (args.preserve_sids or "").split(",") if s.strip()}
 
     filtered = replace_any_placeholders_with_bucket_arns(
@@ -605,11 +805,13 @@ def main() -> None:
         preserved = keep
 
     # ----------------------------------
-    # Merge preserved + generated, dedup, write
+    # Merge preserved + generated, dedup
     # ----------------------------------
     final_statements = dedup_statements(preserved + generated_out)
-    policy_out = {"Version": "2012-10-17", "Statement": final_statements}
+    return {"Version": "2012-10-17", "Statement": final_statements}
 
+def write_policy_outputs(args: argparse.Namespace, policy_out: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+    """Writes the final policy (and coverage report); runs even when `policy` came from a checkpoint."""
     dirn = os.path.dirname(args.policy_path)
     if dirn:
         os.makedirs(dirn, exist_ok=True)
@@ -617,5 +819,252 @@ def main() -> None:
         json.dump(policy_out, f, indent=2)
     log(f"[+] Wrote least-privilege policy to {args.policy_path}")
 
+    # ----------------------------------
+    # Optional offline coverage check of the written policy
+    # ----------------------------------
+    if args.coverage_report:
+        t0 = time.perf_counter()
+        preserve_sids = {s.strip() for s in (args.preserve_sids or "").split(",") if s.strip()}
+        pairs = ((a, r) for a, r in outputs["cloudtrail"]["pairs"] if keep_action(a))
+        report = evaluate_coverage(policy_out, pairs, ignore_sids=preserve_sids)
+        with open(args.coverage_report, "w") as f:
+            json.dump(report, f, indent=2)
+        log(f"[+] Coverage: {report['covered']}/{report['pairs']} observed pairs covered, "
+            f"{len(report['uncovered'])} uncovered, {len(report['over_broad'])} over-broad entries "
+            f"({time.perf_counter() - t0:.3f}s) -> {args.coverage_report}")
+
+STAGE_FUNCS = {
+    "generate":   stage_generate,
+    "cloudtrail": stage_cloudtrail,
+    "tfstate":    stage_tfstate,
+    "merge":      stage_merge,
+    "policy":     stage_policy,
+}
+
+def run_pipeline(args: argparse.Namespace, clients: AwsClients) -> None:
+    """
+    Runs STAGES in order, checkpointing each output to args.run_dir.
+    --resume reuses every valid checkpoint up to the first stage that has to run;
+    --from-stage loads the stages before it from checkpoints and reruns the rest.
+    """
+    run_dir = RunDir(args.run_dir) if args.run_dir else None
+    reuse = bool(run_dir) and (args.resume or bool(args.from_stage))
+
+    # a replay cassette, or the run being resumed, pins the analysis window
+    cassette = clients.cassette
+    pinned = (cassette.meta.get("end_time") if cassette is not None else None) \
+        or (run_dir.pinned_end() if reuse else None)
+    end = dt.datetime.fromisoformat(pinned) if pinned else dt.datetime.utcnow().replace(microsecond=0)
+    if cassette is not None:
+        cassette.meta["end_time"] = end.isoformat()
+    if run_dir is not None:
+        run_dir.pin(end)
+    start = end - dt.timedelta(hours=args.lookback_hours)
+
+    first = STAGES.index(args.from_stage) if args.from_stage else 0
+    outputs: Dict[str, Any] = {}
+    ran_upstream = False
+    checkpointing = run_dir is not None
+    for i, stage in enumerate(STAGES):
+        data = None
+        if run_dir is not None and (i < first or (args.resume and not args.from_stage and not ran_upstream)):
+            data = run_dir.load(stage, args)
+            if data is None and i < first:
+                raise SystemExit(f"--from-stage {args.from_stage}: no usable '{stage}' checkpoint in {args.run_dir}")
+            if data is not None:
+                log(f"[=] Stage {stage}: using checkpoint {os.path.join(args.run_dir, STAGE_FILES[stage])}")
+        if data is None:
+            ran_upstream = True  # later stages depend on this output: never reuse their checkpoints
+            t0 = time.perf_counter()
+            data = STAGE_FUNCS[stage](args, clients, start, end, outputs)
+            if isinstance(data, dict) and data.pop("incomplete", False):
+                checkpointing = False  # this and every later stage must rerun on --resume
+            if checkpointing:
+                run_dir.save(stage, args, data)
+            elif run_dir is not None:
+                run_dir.discard(stage)
+            log(f"[+] Stage {stage} done in {time.perf_counter() - t0:.2f}s")
+        outputs[stage] = data
+
+    write_policy_outputs(args, outputs["policy"], outputs)
+
+# -------------------------
+# Org mode: fan out over accounts with a process pool
+# -------------------------
+_ORG_LIMITER: Optional[RateLimiter] = None
+
+def load_targets(path: str) -> List[Dict[str, str]]:
+    """
+    JSON list of {"account_id", "role_arn", "principal_arn"} objects; optional
+    "region", "backend_path", "trail_arn" and "access_role_arn" override the CLI values.
+    """
+    with open(path, "r") as f:
+        targets = json.load(f)
+    for t in targets:
+        missing = [k for k in ("account_id", "role_arn", "principal_arn") if not t.get(k)]
+        if missing:
+            raise SystemExit(f"Target {t} is missing: {', '.join(missing)}")
+    return targets
+
+def per_account_path(path: str, account_id: str) -> str:
+    # plain substitution, not str.format: other braces in the path are literal
+    if "{account_id}" in path:
+        return path.replace("{account_id}", account_id)
+    return os.path.join(os.path.dirname(path), account_id, os.path.basename(path))
+
+def assume_target_session(target: Dict[str, str]) -> Any:
+    import boto3
+    sts = boto3.client("sts")
+    creds = sts.assume_role(RoleArn=target["role_arn"],
+                            RoleSessionName=f"ci-least-priv-{target['account_id']}")["Credentials"]
+    return boto3.session.Session(
+        aws_access_key_id=creds["AccessKeyId"],
+        aws_secret_access_key=creds["SecretAccessKey"],
+        aws_session_token=creds["SessionToken"],
+        region_name=target.get("region") or boto3.session.Session().region_name,
+    )
+
+def _init_org_worker(limiter: Optional[RateLimiter]) -> None:
+    global _ORG_LIMITER
+    _ORG_LIMITER = limiter
+
+def run_target(target: Dict[str, str], args: argparse.Namespace,
+               session_factory: Callable[[Dict[str, str]], Any] = assume_target_session) -> Dict[str, Any]:
+    _log_ctx.prefix = f"[{target['account_id']}] "
+    t0 = time.perf_counter()
+    out: Dict[str, Any] = {
+        "account_id": target["account_id"],
+        "principal_arn": target["principal_arn"],
+        "policy_path": None,
+        "status": "ok",
+        "error": None,
+    }
+    try:
+        out["policy_path"] = per_account_path(args.policy_path, target["account_id"])
+        t_args = argparse.Namespace(**{
+            **vars(args),
+            "principal_arn": target["principal_arn"],
+            "policy_path": out["policy_path"],
+            "backend_path": target.get("backend_path") or args.backend_path,
+            "trail_arn": target.get("trail_arn") or args.trail_arn,
+            "access_role_arn": target.get("access_role_arn") or args.access_role_arn,
+            "coverage_report": per_account_path(args.coverage_report, target["account_id"]) if args.coverage_report else None,
+            "run_dir": os.path.join(args.run_dir, target["account_id"]) if args.run_dir else None,
+        })
+        cassette = open_cassette(t_args, target["account_id"])
+        session = replay_session(cassette) if args.replay else None
+        try:
+            run_pipeline(t_args, AwsClients(session, _ORG_LIMITER, cassette,
+                                            session_factory=lambda: session_factory(target)))
+        finally:
+            if cassette is not None:
+                cassette.close()
+    except (Exception, SystemExit) as e:
+        out["status"] = "failed"
+        out["error"] = str(e) or type(e).__name__
+        log(f"[!] Failed: {out['error']}")
+    finally:
+        _log_ctx.prefix = ""
+    out["seconds"] = round(time.perf_counter() - t0, 2)
+    return out
+
+def run_org(targets: List[Dict[str, str]], args: argparse.Namespace,
+            session_factory: Callable[[Dict[str, str]], Any] = assume_target_session,
+            executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
+    """Runs every target's pipeline; pass `executor` (e.g. a thread pool) to avoid processes in tests."""
+    limiter = RateLimiter(args.org_rate) if args.org_rate else None
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=args.org_workers,
+                                       initializer=_init_org_worker, initargs=(limiter,))
+    else:
+        _init_org_worker(limiter)
+
+    results: List[Dict[str, Any]] = []
+    with executor:
+        futures = [(t, executor.submit(run_target, t, args, session_factory)) for t in targets]
+        for t, fut in futures:
+            try:
+                results.append(fut.result())
+            except Exception as e:  # worker died or args didn't pickle
+                results.append({"account_id": t["account_id"], "principal_arn": t["principal_arn"],
+                                "policy_path": per_account_path(args.policy_path, t["account_id"]),
+                                "status": "failed", "error": str(e) or type(e).__name__, "seconds": None})
+    return results
+
+def log_org_summary(results: List[Dict[str, Any]], wall_s: float) -> None:
+    failed = [r for r in results if r["status"] != "ok"]
+    log(f"[*] Org run: {len(results) - len(failed)}/{len(results)} accounts succeeded in {wall_s:.1f}s")
+    for r in sorted(results, key=lambda r: r["account_id"]):
+        secs = "-" if r["seconds"] is None else f"{r['seconds']:.1f}s"
+        line = f"    {r['account_id']:<14} {r['status']:<7} {secs:>8}  {r['policy_path']}"
+        log(line + (f"  ({r['error']})" if r["error"] else ""))
+
+# -------------------------
+# Main
+# -------------------------
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Generate least-priv IAM policy via IAM Access Analyzer from CloudTrail evidence")
+    ap.add_argument("--principal-arn", help="Role/User ARN to analyze (required unless --targets is given)")
+    ap.add_argument("--policy-path", required=True,
+                    help="File to write the generated JSON policy; with --targets may contain {account_id}")
+    ap.add_argument("--lookback-hours", type=int, default=24, help="Hours to analyze (max 2160)")
+    ap.add_argument("--trail-arn", help="CloudTrail trail ARN (optional)")
+    ap.add_argument("--access-role-arn", help="IAM role AA assumes to read the trail's S3 bucket (optional)")
+    ap.add_argument("--regions", default="", help="CSV regions for the trail; omit to use allRegions=true")
+    ap.add_argument("--keep-star-resources", action="store_true", help="Keep statements with Resource:'*' (default: drop)")
+    ap.add_argument("--preserve-sids", default=",".join(sorted(DEFAULT_PRESERVE_SIDS)),
+                    help="Comma-separated list of Sid values to preserve from existing policy file")
+    ap.add_argument("--backend-path", default="backend.tf", help="Path to Terraform backend.tf for auto-loading S3 state")
+    ap.add_argument("--evidence-source", choices=["cloudtrail", "tfstate", "union", "intersection"], default="union",
+                    help="Which evidence to use when replacing placeholders (default: union)")
+    ap.add_argument("--drop-unresolved-placeholders", action="store_true",
+                    help="Drop statements that still contain ${...} after replacement")
+    ap.add_argument("--coverage-report",
+                    help="Check observed CloudTrail (action, resource) pairs against the written policy offline and write the report here")
+    ap.add_argument("--targets",
+                    help="Org mode: JSON file listing {account_id, role_arn, principal_arn} to analyze in parallel")
+    ap.add_argument("--org-workers", type=int, default=4, help="Org mode: accounts processed concurrently")
+    ap.add_argument("--org-rate", type=float, default=0,
+                    help="Org mode: max AWS API calls/sec across all workers (0 = unlimited)")
+    ap.add_argument("--org-summary", help="Org mode: write the per-account summary JSON here")
+    ap.add_argument("--run-dir", default=".least-priv-run",
+                    help="Directory for stage checkpoints (default: .least-priv-run; '' disables checkpointing)")
+    ap.add_argument("--resume", action="store_true", help="Skip stages whose checkpoint in --run-dir is still valid")
+    ap.add_argument("--from-stage", choices=STAGES,
+                    help="Load earlier stages from --run-dir checkpoints and rerun from this stage on (e.g. merge, policy)")
+    rec = ap.add_mutually_exclusive_group()
+    rec.add_argument("--record", metavar="DIR", help="Record every AWS response of this run to compressed cassettes in DIR")
+    rec.add_argument("--replay", metavar="DIR", help="Serve every AWS call from cassettes in DIR (no network, no credentials)")
+    args = ap.parse_args()
+
+    if (args.resume or args.from_stage) and not args.run_dir:
+        ap.error("--resume / --from-stage need --run-dir")
+
+    if not args.targets:
+        if not args.principal_arn:
+            ap.error("--principal-arn is required unless --targets is given")
+        cassette = open_cassette(args)
+        session = replay_session(cassette) if args.replay else None
+        t0 = time.perf_counter()
+        try:
+            run_pipeline(args, AwsClients(session, cassette=cassette))
+        finally:
+            if cassette is not None:
+                cassette.close()
+                log(f"[*] {'Recorded' if args.record else 'Replayed'} run in {time.perf_counter() - t0:.2f}s "
+                    f"({args.record or args.replay})")
+        return
+
+    targets = load_targets(args.targets)
+    t0 = time.perf_counter()
+    results = run_org(targets, args)
+    wall_s = time.perf_counter() - t0
+    log_org_summary(results, wall_s)
+    if args.org_summary:
+        with open(args.org_summary, "w") as f:
+            json.dump({"wall_seconds": round(wall_s, 2), "accounts": results}, f, indent=2)
+    if any(r["status"] != "ok" for r in results):
+        raise SystemExit(1)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Offline coverage check of a generated IAM policy against observed API calls.
+
+Compiles the policy into an index keyed by service prefix (exact action names
+plus wildcard action patterns, each carrying its statement's compiled resource
+matcher) and checks observed (action, resource) pairs against it in bulk,
+without calling the IAM simulate API.
+
+Reports:
+  * uncovered   - observed pairs no Allow statement grants (or a Deny blocks)
+  * over_broad  - policy entries no observed pair needed (unused actions or
+                  resources) and wildcard resources that only matched a
+                  handful of concrete ARNs
+
+Conditions, NotAction and NotResource are not evaluated; statements using them
+are listed under "unevaluated". A pair whose resource is unknown (None) is
+checked at action level only.
+
+Observed events map to pairs by their IAM action (eventName, translated where
+the operation is authorized by another action, e.g. ListObjectsV2 →
+s3:ListBucket) and the ARNs in the event's own resources[].
+
+Usage:
+  python services/query-ct-lack/policy_coverage.py --policy policy.json --pairs pairs.json
+  (pairs.json: [["ec2:CreateVpc", "arn:aws:ec2:...:vpc/vpc-1"], ["s3:ListAllMyBuckets", null], ...])
+"""
+import argparse
+import json
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+Pair = Tuple[str, Optional[str]]
+
+# eventSource host → IAM service prefix, where they differ
+EVENT_SOURCE_PREFIXES = {
+    "monitoring": "cloudwatch",
+    "email": "ses",
+    "tagging": "tag",
+}
+
+# eventName → IAM action, where the API operation is authorized by another action
+EVENT_NAME_ACTIONS = {
+    "s3:ListObjects":                          "s3:ListBucket",
+    "s3:ListObjectsV2":                        "s3:ListBucket",
+    "s3:ListObjectVersions":                   "s3:ListBucketVersions",
+    "s3:HeadBucket":                           "s3:ListBucket",
+    "s3:HeadObject":                           "s3:GetObject",
+    "s3:CopyObject":                           "s3:PutObject",
+    "s3:CreateMultipartUpload":                "s3:PutObject",
+    "s3:UploadPart":                           "s3:PutObject",
+    "s3:UploadPartCopy":                       "s3:PutObject",
+    "s3:CompleteMultipartUpload":              "s3:PutObject",
+    "s3:DeleteObjects":                        "s3:DeleteObject",
+    "s3:ListMultipartUploads":                 "s3:ListBucketMultipartUploads",
+    "s3:ListParts":                            "s3:ListMultipartUploadParts",
+    "s3:GetBucketLifecycleConfiguration":      "s3:GetLifecycleConfiguration",
+    "s3:PutBucketLifecycleConfiguration":      "s3:PutLifecycleConfiguration",
+    "s3:DeleteBucketLifecycle":                "s3:PutLifecycleConfiguration",
+    "s3:GetBucketEncryption":                  "s3:GetEncryptionConfiguration",
+    "s3:PutBucketEncryption":                  "s3:PutEncryptionConfiguration",
+    "s3:DeleteBucketEncryption":               "s3:PutEncryptionConfiguration",
+    "s3:GetBucketReplication":                 "s3:GetReplicationConfiguration",
+    "s3:PutBucketReplication":                 "s3:PutReplicationConfiguration",
+    "s3:DeleteBucketReplication":              "s3:PutReplicationConfiguration",
+    "s3:GetBucketNotificationConfiguration":   "s3:GetBucketNotification",
+    "s3:PutBucketNotificationConfiguration":   "s3:PutBucketNotification",
+    "s3:DeleteBucketTagging":                  "s3:PutBucketTagging",
+    "s3:DeleteBucketCors":                     "s3:PutBucketCORS",
+    "s3:GetPublicAccessBlock":                 "s3:GetBucketPublicAccessBlock",
+    "s3:PutPublicAccessBlock":                 "s3:PutBucketPublicAccessBlock",
+    "s3:DeletePublicAccessBlock":              "s3:PutBucketPublicAccessBlock",
+    "s3:DeleteBucketOwnershipControls":        "s3:PutBucketOwnershipControls",
+}
+
+# API version suffixes some services append to eventName (GetFunction20150331v2)
+EVENT_NAME_VERSION_RE = re.compile(r"(?:\d{8}|\d{4}_\d{2}_\d{2})(?:v\d+)?$")
+VERSIONED_EVENT_SOURCES = {"lambda", "cloudfront"}
+
+# S3 actions authorized on the object ARN (bucket/key); the rest are bucket-level
+S3_OBJECT_ACTION_RE = re.compile(r"Object(?!LockConfiguration)|^(?:AbortMultipartUpload|ListMultipartUploadParts)$")
+
+WILDCARD_SAMPLE = 5  # concrete ARNs listed per over-broad wildcard resource
+
+def event_action(detail: Dict[str, Any]) -> Optional[str]:
+    src = detail.get("eventSource")
+    name = detail.get("eventName")
+    if not (isinstance(src, str) and isinstance(name, str) and src and name):
+        return None
+    svc = src.split(".", 1)[0]
+    if svc in VERSIONED_EVENT_SOURCES:
+        name = EVENT_NAME_VERSION_RE.sub("", name) or name
+    action = f"{EVENT_SOURCE_PREFIXES.get(svc, svc)}:{name}"
+    return EVENT_NAME_ACTIONS.get(action, action)
+
+def event_resource_arns(detail: Dict[str, Any], action: str) -> Set[str]:
+    """ARNs from the event's resources[] that `action` is authorized against.
+
+    S3 events list both the bucket and the object; object actions pair with the
+    object ARN only, bucket actions with the bucket ARN only.
+    """
+    arns: Set[str] = set()
+    for r in detail.get("resources") or []:
+        if not isinstance(r, dict):
+            continue
+        for k in ("ARN", "resourceName"):
+            v = r.get(k)
+            if isinstance(v, str) and v.startswith("arn:aws"):
+                arns.add(v)
+    svc, _, name = action.partition(":")
+    if svc == "s3":
+        want_object = bool(S3_OBJECT_ACTION_RE.search(name))
+        arns = {a for a in arns if ("/" in a.split(":::", 1)[-1]) == want_object}
+    return arns
+
+def _as_list(v: Any) -> List[Any]:
+    if v is None:
+        return []
+    return v if isinstance(v, list) else [v]
+
+def _glob_re(patterns: Iterable[str]) -> Optional["re.Pattern[str]"]:
+    parts = [re.escape(p).replace(r"\*", ".*").replace(r"\?", ".") for p in patterns]
+    return re.compile("(?:" + "|".join(parts) + r")\Z") if parts else None
+
+# -------------------------
+# Compiled statement / index
+# -------------------------
+class CompiledStatement:
+    def __init__(self, idx: int, stmt: Dict[str, Any]):
+        self.idx = idx
+        self.sid = stmt.get("Sid") or f"#{idx}"
+        self.effect = stmt.get("Effect", "Allow")
+        self.actions = [a for a in _as_list(stmt.get("Action")) if isinstance(a, str)]
+        self.resources = [r for r in _as_list(stmt.get("Resource")) if isinstance(r, str)]
+        self.exact_resources = {r for r in self.resources if "*" not in r and "?" not in r}
+        self.wild_resources = [r for r in self.resources if r not in self.exact_resources]
+        self.any_resource = "*" in self.resources
+        self._wild_re = _glob_re(self.wild_resources)
+        self._wild_each = [(r, _glob_re([r])) for r in self.wild_resources]
+
+    def matched_resource(self, resource: Optional[str]) -> Optional[str]:
+        """Return the Resource entry that grants `resource` ("" = action-level only), or None."""
+        if resource is None:
+            return "" if self.resources else None
+        if resource in self.exact_resources:
+            return resource
+        if self._wild_re is None or not self._wild_re.match(resource):
+            return None
+        if self.any_resource:
+            return "*"
+        for entry, rx in self._wild_each:
+            if rx.match(resource):
+                return entry
+        return None
+
+class PolicyIndex:
+    """Statements indexed by lowercased service prefix, then by exact action name."""
+    def __init__(self, policy: Dict[str, Any]):
+        self.statements: List[CompiledStatement] = []
+        self.unevaluated: List[str] = []
+        self._exact: Dict[str, Dict[str, List[Tuple[CompiledStatement, str]]]] = defaultdict(lambda: defaultdict(list))
+        self._wild: Dict[str, List[Tuple["re.Pattern[str]", CompiledStatement, str]]] = defaultdict(list)
+        self._cache: Dict[str, List[Tuple[CompiledStatement, str]]] = {}
+
+        for i, stmt in enumerate(_as_list(policy.get("Statement"))):
+            if not isinstance(stmt, dict):
+                continue
+            cs = CompiledStatement(i, stmt)
+            if any(k in stmt for k in ("Condition", "NotAction", "NotResource")):
+                self.unevaluated.append(cs.sid)
+            self.statements.append(cs)
+            for a in cs.actions:
+                svc, _, name = a.lower().partition(":")
+                if a == "*":
+                    self._wild["*"].append((re.compile(".*"), cs, a))
+                elif "*" in name or "?" in name:
+                    self._wild[svc].append((_glob_re([name]), cs, a))
+                else:
+                    self._exact[svc][name].append((cs, a))
+
+    def candidates(self, action: str) -> List[Tuple[CompiledStatement, str]]:
+        """(statement, Action entry) pairs whose Action matches `action`."""
+        hit = self._cache.get(action)
+        if hit is not None:
+            return hit
+        svc, _, name = action.lower().partition(":")
+        out = list(self._exact.get(svc, {}).get(name, ()))
+        for rx, cs, a in self._wild.get(svc, []) + self._wild.get("*", []):
+            if rx.match(name if a != "*" else action):
+                out.append((cs, a))
+        self._cache[action] = out
+        return out
+
+# -------------------------
+# Bulk evaluation
+# -------------------------
+def evaluate(policy: Dict[str, Any], pairs: Iterable[Pair],
+             ignore_sids: Optional[Set[str]] = None) -> Dict[str, Any]:
+    index = PolicyIndex(policy)
+    ignore_sids = ignore_sids or set()
+
+    used_actions: Set[Tuple[int, str]] = set()
+    used_resources: Set[Tuple[int, str]] = set()
+    action_level: Set[int] = set()   # statements hit by pairs with no known resource
+    wildcard_hits: Dict[Tuple[int, str], Set[str]] = defaultdict(set)
+    uncovered: List[Dict[str, Any]] = []
+    total = 0
+
+    for action, resource in set(pairs):
+        total += 1
+        allowed = denied = False
+        for cs, a in index.candidates(action):
+            entry = cs.matched_resource(resource)
+            if entry is None:
+                continue
+            if cs.effect == "Deny":
+                denied = True
+                continue
+            allowed = True
+            used_actions.add((cs.idx, a))
+            if not entry:
+                action_level.add(cs.idx)
+                continue
+            used_resources.add((cs.idx, entry))
+            if entry != resource:
+                wildcard_hits[(cs.idx, entry)].add(resource)
+        if denied or not allowed:
+            uncovered.append({"action": action, "resource": resource, "denied": denied})
+
+    over_broad: List[Dict[str, Any]] = []
+    for cs in index.statements:
+        if cs.effect != "Allow" or cs.sid in ignore_sids:
+            continue
+        for a in cs.actions:
+            if (cs.idx, a) not in used_actions:
+                over_broad.append({"sid": cs.sid, "kind": "unused-action", "entry": a})
+        for r in cs.resources:
+            if (cs.idx, r) not in used_resources and cs.idx not in action_level:
+                over_broad.append({"sid": cs.sid, "kind": "unused-resource", "entry": r})
+            elif r in cs.wild_resources and wildcard_hits.get((cs.idx, r)):
+                seen = sorted(wildcard_hits[(cs.idx, r)])
+                if len(seen) <= WILDCARD_SAMPLE:
+                    over_broad.append({"sid": cs.sid, "kind": "wildcard-resource", "entry": r, "observed": seen})
+
+    uncovered.sort(key=lambda u: (u["action"], u["resource"] or ""))
+    return {
+        "pairs": total,
+        "covered": total - len(uncovered),
+        "uncovered": uncovered,
+        "over_broad": over_broad,
+        "unevaluated": index.unevaluated,
+    }
+
+def load_pairs(path: str) -> List[Pair]:
+    with open(path, "r") as f:
+        data = json.load(f)
+    return [(a, r) for a, r in data]
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Check observed (action, resource) pairs against a policy offline")
+    ap.add_argument("--policy", required=True, help="Policy JSON file to evaluate")
+    ap.add_argument("--pairs", required=True, help='JSON list of [action, resource|null] pairs')
+    ap.add_argument("--ignore-sids", default="", help="Comma-separated Sids excluded from the over-broad report")
+    ap.add_argument("--out", help="Write the report here instead of stdout")
+    args = ap.parse_args()
+
+    with open(args.policy, "r") as f:
+        policy = json.load(f)
+    ignore = {s.strip() for s in args.ignore_sids.split(",") if s.strip()}
+    report = evaluate(policy, load_pairs(args.pairs), ignore_sids=ignore)
+
+    out = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+    raise SystemExit(1 if report["uncovered"] else 0)
+
+if __name__ == "__main__":
+    main()